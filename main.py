@@ -1,14 +1,239 @@
-from dotenv import load_dotenv
-
-load_dotenv()
+from __future__ import annotations
 
+from dotenv import load_dotenv
 import openai
+from openai.types.chat import ChatCompletion
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-from typing import Optional, Dict, List, Any
+from typing import TYPE_CHECKING
 import os
+from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import Nominatim
 import socket
+import re
+import sqlite3
+import threading
+import time
+import hashlib
+from functools import cache, lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from typing import Any
+
+# orjson is an optional, faster drop-in for decoding JSON
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+
+@cache
+def _config() -> None:
+    """Load .env and configure the OpenAI key on first use rather than at import"""
+    load_dotenv()
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+
+
+# Shared HTTP session so the points and forecast requests to api.weather.gov
+# reuse one keep-alive connection instead of a new TLS handshake each time.
+# The pool is sized above the default of 10 so queries on worker threads
+# don't discard connections
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://api.weather.gov",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=50,
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]
+        ),
+    ),
+)
+_SESSION.headers.update(
+    {"User-Agent": "WeatherAssistant/1.0", "Accept": "application/geo+json"}
+)
+
+# One geolocator for the process so its HTTP session stays warm
+_GEOLOCATOR = Nominatim(user_agent="WeatherAssistant/1.0")
+
+# Nominatim's usage policy allows at most one request per second. RateLimiter
+# is thread-safe, so all threads share it. Errors raise at once rather than
+# being retried, so a slow geocoder doesn't stall the whole batch
+_GEOCODE = RateLimiter(
+    _GEOLOCATOR.geocode,
+    min_delay_seconds=1,
+    max_retries=0,
+    swallow_exceptions=False,
+)
+
+# (connect, read) timeouts in seconds for NWS requests
+_TIMEOUT = (3, 10)
+
+# Bump when the structure of cached forecasts changes so old entries are ignored
+_FORECAST_CACHE_VERSION = "gridpoints-forecast/v3"
+# Forecasts are served from cache for _FORECAST_TTL, then revalidated with
+# their ETag until the entry is dropped after _FORECAST_REVALIDATE_TTL
+_FORECAST_TTL = 30 * 60
+_FORECAST_REVALIDATE_TTL = 24 * 60 * 60
+
+# Only the first few periods, and these fields of each, are reported
+_FORECAST_PERIODS = 3
+_PERIOD_FIELDS = (
+    "name",
+    "temperature",
+    "temperatureUnit",
+    "shortForecast",
+    "windSpeed",
+    "windDirection",
+)
+
+# City coordinates practically never change
+_GEOCODE_TTL = 30 * 24 * 60 * 60
+
+_COMPLETION_TTL = 24 * 60 * 60
+
+# Answers to identical queries are reused for a few minutes
+_ANSWER_TTL = 5 * 60
+
+# Matches queries like "What's the weather like in Seattle, WA?". The state
+# must end the query, and is checked with _us_state_code before use
+_WEATHER_RE = re.compile(
+    r"weather.*\bin\s+([A-Za-z .]+?),\s*([A-Za-z][A-Za-z ]*?)\s*[?.!]*$", re.I
+)
+
+_US_STATES = {
+    "AL": "Alabama",
+    "AK": "Alaska",
+    "AZ": "Arizona",
+    "AR": "Arkansas",
+    "CA": "California",
+    "CO": "Colorado",
+    "CT": "Connecticut",
+    "DE": "Delaware",
+    "DC": "District of Columbia",
+    "FL": "Florida",
+    "GA": "Georgia",
+    "HI": "Hawaii",
+    "ID": "Idaho",
+    "IL": "Illinois",
+    "IN": "Indiana",
+    "IA": "Iowa",
+    "KS": "Kansas",
+    "KY": "Kentucky",
+    "LA": "Louisiana",
+    "ME": "Maine",
+    "MD": "Maryland",
+    "MA": "Massachusetts",
+    "MI": "Michigan",
+    "MN": "Minnesota",
+    "MS": "Mississippi",
+    "MO": "Missouri",
+    "MT": "Montana",
+    "NE": "Nebraska",
+    "NV": "Nevada",
+    "NH": "New Hampshire",
+    "NJ": "New Jersey",
+    "NM": "New Mexico",
+    "NY": "New York",
+    "NC": "North Carolina",
+    "ND": "North Dakota",
+    "OH": "Ohio",
+    "OK": "Oklahoma",
+    "OR": "Oregon",
+    "PA": "Pennsylvania",
+    "RI": "Rhode Island",
+    "SC": "South Carolina",
+    "SD": "South Dakota",
+    "TN": "Tennessee",
+    "TX": "Texas",
+    "UT": "Utah",
+    "VT": "Vermont",
+    "VA": "Virginia",
+    "WA": "Washington",
+    "WV": "West Virginia",
+    "WI": "Wisconsin",
+    "WY": "Wyoming",
+}
+_US_STATE_CODES = {name.lower(): code for code, name in _US_STATES.items()}
+
+# Longer queries go to OpenAI; this also bounds the regex's backtracking
+_FAST_PATH_MAX_LENGTH = 200
+
+
+class ToolError(Exception):
+    """Raised by a tool that could not produce an answer.
+
+    The message is shown to the user as is, and the answer is not cached.
+    """
+
+
+class _DiskCache:
+    """Small sqlite-backed key/value store of JSON values with per-entry expiry"""
+
+    def __init__(self, filename: str):
+        self._filename = filename
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Open lazily so importing the module does no disk I/O
+        if self._conn is None:
+            # WEATHER_CACHE_DIR may come from .env
+            _config()
+            cache_dir = os.path.expanduser(
+                os.getenv("WEATHER_CACHE_DIR", "~/.cache/weather")
+            )
+            os.makedirs(cache_dir, exist_ok=True)
+            self._conn = sqlite3.connect(
+                os.path.join(cache_dir, self._filename), check_same_thread=False
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            # get() ignores expired rows, so drop them here to bound the file size
+            self._conn.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+            self._conn.commit()
+        return self._conn
+
+    # Caching is best effort: if the cache can't be opened, read or written,
+    # get() reports a miss and set() does nothing
+
+    def get(self, key: str) -> Any:
+        """Return the cached value for key, or None if missing or expired"""
+        try:
+            with self._lock:
+                row = (
+                    self._connect()
+                    .execute("SELECT value, expires FROM cache WHERE key = ?", (key,))
+                    .fetchone()
+                )
+            if row and row[1] > time.time():
+                return _json_loads(row[0])
+        except (sqlite3.Error, OSError, ValueError):
+            pass
+        return None
+
+    def set(self, key: str, value: Any, expire: float) -> None:
+        """Store a JSON-serializable value for expire seconds"""
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires) "
+                    "VALUES (?, ?, ?)",
+                    (key, json.dumps(value), time.time() + expire),
+                )
+                conn.commit()
+        except (sqlite3.Error, OSError):
+            pass
+
+
+_CACHE = _DiskCache("cache.sqlite3")
 
 # Define the tool schema
 TOOLS = [
@@ -47,121 +272,309 @@ TOOLS = [
 ]
 
 
-def get_coordinates(city: str, state: str) -> Optional[Dict[str, float]]:
-    """Get latitude and longitude for a US city using Geopy"""
-    geolocator = Nominatim(user_agent="WeatherAssistant/1.0")
-    location = geolocator.geocode(f"{city}, {state}, USA")
+class _NotFound(Exception):
+    """Raised by _geocode_cached when Nominatim has no match for a city"""
+
+
+@lru_cache(maxsize=4096)
+def _geocode_cached(city: str, state: str) -> tuple[float, float]:
+    """Geocode a normalized city/state pair, memoized per process and on disk.
+
+    Raises _NotFound when the city is not found, so that misses are not
+    memoized and a later call tries Nominatim again.
+    """
+    cache_key = f"geocode:{city}:{state}"
+    cached = _CACHE.get(cache_key)
+    if cached is not None:
+        return tuple(cached)
+
+    location = _GEOCODE(f"{city}, {state}, USA")
 
     if location:
-        return {"latitude": location.latitude, "longitude": location.longitude}
+        coords = (location.latitude, location.longitude)
+        _CACHE.set(cache_key, coords, expire=_GEOCODE_TTL)
+        return coords
     else:
+        raise _NotFound(f"{city}, {state} not found")
+
+
+def get_coordinates(city: str, state: str) -> dict[str, float] | None:
+    """Get latitude and longitude for a US city using Geopy"""
+    try:
+        coords = _geocode_cached(city.lower().strip(), state.upper().strip())
+    except _NotFound:
         return None
 
+    return {"latitude": coords[0], "longitude": coords[1]}
+
 
-def get_forecast(latitude: float, longitude: float) -> Optional[Dict[str, Any]]:
+@lru_cache(maxsize=4096)
+def _get_grid_point(latitude: float, longitude: float) -> tuple[str, str]:
+    """Look up the NWS grid cell and its forecast URL, memoized per process"""
+    point_url = f"https://api.weather.gov/points/{latitude},{longitude}"
+    point_response = _SESSION.get(point_url, timeout=_TIMEOUT)
+    point_response.raise_for_status()
+    properties = _json_loads(point_response.content)["properties"]
+
+    grid_key = f"{properties['gridId']}/{properties['gridX']},{properties['gridY']}"
+    return grid_key, properties["forecast"]
+
+
+def get_forecast(latitude: float, longitude: float) -> dict[str, Any] | None:
     """Get weather forecast from NWS API using coordinates"""
 
     try:
-        # First get the grid points
-        point_url = f"https://api.weather.gov/points/{latitude},{longitude}"
-        point_response = requests.get(point_url)
-        point_response.raise_for_status()
-        point_data = point_response.json()
-
-        # Get the forecast URL from the points response
-        forecast_url = point_data["properties"]["forecast"]
-        forecast_response = requests.get(forecast_url)
+        # First get the grid points. NWS grid cells are ~2.5km, so rounding
+        # lets nearby coordinates share a cached forecast URL
+        grid_key, forecast_url = _get_grid_point(
+            round(latitude, 3), round(longitude, 3)
+        )
+
+        # Forecasts are the same for every point in a grid cell
+        cache_key = f"{_FORECAST_CACHE_VERSION}:{grid_key}"
+        entry = _CACHE.get(cache_key)
+        if entry is not None and time.time() - entry["fetched"] < _FORECAST_TTL:
+            return entry["forecast"]
+
+        # A stale entry can still be revalidated with its ETag, in which case
+        # NWS answers 304 without resending the body
+        headers = {}
+        if entry is not None and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+
+        forecast_response = _SESSION.get(
+            forecast_url, headers=headers, timeout=_TIMEOUT
+        )
         forecast_response.raise_for_status()
 
-        return forecast_response.json()
+        if forecast_response.status_code == 304:
+            forecast = entry["forecast"]
+        else:
+            data = _json_loads(forecast_response.content)
+            periods = data["properties"]["periods"]
+
+            # Keep just what get_weather_forecast reports so entries stay small
+            forecast = {
+                "properties": {
+                    "periods": [
+                        {field: period[field] for field in _PERIOD_FIELDS}
+                        for period in periods[:_FORECAST_PERIODS]
+                    ]
+                }
+            }
+
+        _CACHE.set(
+            cache_key,
+            {
+                "etag": forecast_response.headers.get("ETag")
+                or (entry and entry["etag"]),
+                "fetched": time.time(),
+                "forecast": forecast,
+            },
+            expire=_FORECAST_REVALIDATE_TTL,
+        )
+        return forecast
     except Exception as e:
         print(f"Error getting forecast: {e}")
         return None
 
 
 def get_weather_forecast(city: str, state: str) -> str:
-    """Function that will be called by the OpenAI tool"""
+    """Function that will be called by the OpenAI tool. Raises ToolError on failure"""
     coords = get_coordinates(city, state)
     if not coords:
-        return f"Could not find coordinates for {city}, {state}"
+        raise ToolError(f"Could not find coordinates for {city}, {state}")
 
     forecast = get_forecast(coords["latitude"], coords["longitude"])
     if not forecast:
-        return f"Could not get forecast for {city}, {state}"
+        raise ToolError(f"Could not get forecast for {city}, {state}")
 
     # Extract the next few periods of forecast
-    periods = forecast["properties"]["periods"][:3]
+    periods = forecast["properties"]["periods"][:_FORECAST_PERIODS]
 
     # Format the response
-    response = f"Weather forecast for {city}, {state}:\n\n"
-    for period in periods:
-        response += f"{period['name']}:\n"
-        response += (
-            f"Temperature: {period['temperature']}°{period['temperatureUnit']}\n"
-        )
-        response += f"Conditions: {period['shortForecast']}\n"
-        response += f"Wind: {period['windSpeed']} {period['windDirection']}\n\n"
+    parts = [f"Weather forecast for {city}, {state}:\n\n"]
+    parts.extend(
+        f"{period['name']}:\n"
+        f"Temperature: {period['temperature']}°{period['temperatureUnit']}\n"
+        f"Conditions: {period['shortForecast']}\n"
+        f"Wind: {period['windSpeed']} {period['windDirection']}\n\n"
+        for period in periods
+    )
+
+    return "".join(parts)
+
+
+# Seconds before a resolved address is looked up again
+_DNS_TTL = 300
 
-    return response
+
+@lru_cache(maxsize=1024)
+def _resolve(hostname: str, ttl_bucket: int) -> str:
+    """Resolve hostname to its first IPv4 or IPv6 address.
+
+    ttl_bucket is part of the cache key only, so entries age out when it
+    changes every _DNS_TTL seconds.
+    """
+    addresses = socket.getaddrinfo(hostname, None, type=socket.SOCK_STREAM)
+    return addresses[0][4][0]
 
 
 def get_ip_address(hostname: str) -> str:
     """Get the IP address of a given FQDN hostname"""
     try:
-        ip_address = socket.gethostbyname(hostname)
+        ip_address = _resolve(hostname, int(time.monotonic() // _DNS_TTL))
         return f"The IP address of {hostname} is {ip_address}"
     except Exception as e:
-        return f"Error getting IP address for {hostname}: {e}"
+        raise ToolError(f"Error getting IP address for {hostname}: {e}") from e
+
+
+# Local implementations of the tools declared in TOOLS
+TOOLS_REGISTRY: dict[str, Callable[..., str]] = {
+    "get_weather_forecast": get_weather_forecast,
+    "get_ip_address": get_ip_address,
+}
+
+
+def _call_tool(tool_call) -> str:
+    """Run the local function requested by a single OpenAI tool call"""
+    function_name = tool_call.function.name
+    function_args = _json_loads(tool_call.function.arguments)
+
+    # Call the appropriate function based on the tool name
+    tool = TOOLS_REGISTRY.get(function_name)
+    if tool is None:
+        raise ToolError(f"Unknown function: {function_name}")
+    return tool(**function_args)
+
+
+def _call_tools(tool_calls) -> str:
+    """Run independent tool calls concurrently and join their results in order"""
+    with ThreadPoolExecutor(max_workers=len(tool_calls)) as executor:
+        futures = [executor.submit(_call_tool, tool_call) for tool_call in tool_calls]
+
+    # Report every result, but don't let a partial failure be cached
+    results, failed = [], False
+    for future in futures:
+        try:
+            results.append(future.result())
+        except ToolError as e:
+            results.append(str(e))
+            failed = True
+
+    result = "\n".join(results)
+    if failed:
+        raise ToolError(result)
+    return result
+
+
+def _hash(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+# TOOLS never changes at runtime, so serialize and hash it once
+_TOOLS_HASH = _hash(TOOLS)
+
+
+def _create_completion(model: str, messages: list[dict[str, str]]):
+    """Create a chat completion with TOOLS, optionally reusing a cached response"""
+    # Set WEATHER_CACHE_COMPLETIONS=1 to reuse OpenAI responses between runs
+    if os.getenv("WEATHER_CACHE_COMPLETIONS") != "1":
+        return openai.chat.completions.create(
+            model=model, messages=messages, tools=TOOLS
+        )
+
+    cache_key = f"openai:{model}:{_hash(messages)}:{_TOOLS_HASH}"
+    cached = _CACHE.get(cache_key)
+    if cached is not None:
+        return ChatCompletion.model_validate(cached)
+
+    response = openai.chat.completions.create(
+        model=model, messages=messages, tools=TOOLS
+    )
+    _CACHE.set(cache_key, response.model_dump(mode="json"), expire=_COMPLETION_TTL)
+    return response
+
+
+def _answer_with_openai(query: str) -> str:
+    """Answer a query with OpenAI, running any tools the model asks for"""
+    # Make the initial request to OpenAI
+    response = _create_completion(
+        model="gpt-4o-mini",  # or your preferred model
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a helpful assistant.",
+            },
+            {"role": "user", "content": query},
+        ],
+    )
+
+    # Check if there are tool calls in the response
+    tool_calls = response.choices[0].message.tool_calls
+    if tool_calls:
+        if len(tool_calls) == 1:
+            return _call_tool(tool_calls[0])
+        # Independent tool calls (e.g. several cities) run concurrently
+        return _call_tools(tool_calls)
+
+    # Display any other responses
+    return response.choices[0].message.content
+
+
+def _us_state_code(state: str) -> str | None:
+    """Return the code for a US state given as WA or Washington, else None.
+
+    Codes must be uppercase, so words like "ok" or "or" are not taken as
+    states. Names match regardless of case.
+    """
+    if state in _US_STATES:
+        return state
+    return _US_STATE_CODES.get(state.lower())
 
 
 def process_weather_query(query: str) -> str:
     """Process a natural language weather query using OpenAI's tools"""
 
     try:
-        # Make the initial request to OpenAI
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",  # or your preferred model
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant.",
-                },
-                {"role": "user", "content": query},
-            ],
-            tools=TOOLS,
-        )
+        _config()
 
-        # Check if there are tool calls in the response
-        if response.choices[0].message.tool_calls:
-            # Determine which tool is being called
-            tool_call = response.choices[0].message.tool_calls[0]
-            function_name = tool_call.function.name
-            function_args = json.loads(tool_call.function.arguments)
-
-            # Call the appropriate function based on the tool name
-            if function_name == "get_weather_forecast":
-                result = get_weather_forecast(
-                    city=function_args["city"], state=function_args["state"]
-                )
-            elif function_name == "get_ip_address":
-                result = get_ip_address(hostname=function_args["hostname"])
-            else:
-                result = f"Unknown function: {function_name}"
+        cache_key = f"answer:{query}"
+        cached = _CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Plain "weather in City, State" questions don't need the model
+        match = None
+        if len(query) <= _FAST_PATH_MAX_LENGTH:
+            match = _WEATHER_RE.search(query)
+        state = match and _us_state_code(match.group(2))
+        if state:
+            result = get_weather_forecast(city=match.group(1).strip(), state=state)
         else:
-            # Display any other responses
-            result = response.choices[0].message.content
+            result = _answer_with_openai(query)
 
+        _CACHE.set(cache_key, result, expire=_ANSWER_TTL)
         return result
 
+    except ToolError as e:
+        return str(e)
     except Exception as e:
         return f"Error processing weather query: {e}"
 
 
+def process_weather_queries(queries: list[str]) -> list[str]:
+    """Process independent queries concurrently, returning results in order"""
+    if not queries:
+        return []
+
+    # Each query waits mostly on OpenAI, so overlapping them hides that latency
+    with ThreadPoolExecutor(max_workers=min(len(queries), 16)) as executor:
+        return list(executor.map(process_weather_query, queries))
+
+
 # Example usage
 if __name__ == "__main__":
-    # Set your OpenAI API key
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-
     # Example queries
     example_queries = [
         "Say hello",
@@ -171,9 +584,10 @@ if __name__ == "__main__":
         "My blog is at oshea00.github.io",
     ]
 
-    for query in example_queries:
+    results = process_weather_queries(example_queries)
+
+    for query, result in zip(example_queries, results):
         print(f"\nQuery: {query}")
         print("-" * 50)
-        result = process_weather_query(query)
         print(result)
         print("=" * 50)